@@ -1,16 +1,17 @@
 import os
 import asyncio
 from bleak import BleakClient
-from PIL import Image, ImageEnhance
 
 ADDRESS = "2C:CF:67:04:CF:1B"  # ペリフェラルのMACアドレス
 CHAR_UUID = "87654321-4321-8765-4321-fedcba987654"  # キャラクターID
+IMAGE_SIZE = (250, 122)  # 画像サイズ
+MTU = 244
 
 def prepare_image(file_path, size):
     """
     画像を電子ペーパー用に変換する。
     """
-    from PIL import ImageFilter
+    from PIL import Image, ImageEnhance, ImageFilter
     
     img = Image.open(file_path).convert("L")  # グレースケールに変換
 
@@ -39,6 +40,8 @@ def reconstruct_image(data, size, output_path):
     """
     バイトデータから画像を再構築し、保存する。
     """
+    from PIL import Image
+
     try:
         img = Image.frombytes("1", size, bytes(data))
         img.save(output_path)
@@ -46,59 +49,78 @@ def reconstruct_image(data, size, output_path):
     except Exception as e:
         print(f"[ERROR] Failed to reconstruct image: {e}")
 
-async def send_image(file_path_black, file_path_red, size, mtu):
+def prepare_frame(file_path_black, file_path_red, size):
+    """
+    黒と赤の画像を変換し、送信用に結合したバイトデータを返す。
+    """
     data_black = prepare_image(file_path_black, size)
     data_red = prepare_image(file_path_red, size)
+    return data_black + data_red  # 黒と赤を結合
 
-    combined_data = data_black + data_red  # 黒と赤を結合
+async def send_image(file_path_black, file_path_red, size, mtu, address=ADDRESS):
+    combined_data = prepare_frame(file_path_black, file_path_red, size)
+    return await send_frame(combined_data, mtu, address)
+
+async def send_frame(combined_data, mtu, address=ADDRESS, verbose=True):
+    """
+    結合済みのデータをペリフェラルに送信する。成功したら True を返す。
+    verbose=False のときはエラー以外のログを出さない。
+    """
     total_size = len(combined_data) + 4  # ヘッダー4バイトを加えたデータサイズ
     chunk_size = mtu - 3
     header = total_size.to_bytes(4, byteorder='little')  # ヘッダーは4バイト
 
-    print(f"[DEBUG] Total data size (with header): {total_size} bytes")
-    print(f"[DEBUG] Chunk size: {chunk_size} bytes")
+    if verbose:
+        print(f"[DEBUG] Total data size (with header): {total_size} bytes")
+        print(f"[DEBUG] Chunk size: {chunk_size} bytes")
 
     # 実際の送信部分
-    async with BleakClient(ADDRESS) as client:
+    async with BleakClient(address) as client:
         if await client.is_connected():
-            print("[INFO] Connected to peripheral")
+            if verbose:
+                print("[INFO] Connected to peripheral")
 
             # ヘッダーの送信
             try:
                 await client.write_gatt_char(CHAR_UUID, header)
-                print("[INFO] Header sent successfully.")
+                if verbose:
+                    print("[INFO] Header sent successfully.")
             except Exception as e:
                 print(f"[ERROR] Failed to send header: {e}")
-                return
+                return False
 
             # 画像データの送信
             for i in range(0, len(combined_data), chunk_size):
                 chunk = combined_data[i:i + chunk_size]
                 try:
                     await client.write_gatt_char(CHAR_UUID, chunk)
-                    print(f"[INFO] Sent chunk {i // chunk_size + 1}/{-(-len(combined_data) // chunk_size)}: {len(chunk)} bytes")
+                    if verbose:
+                        print(f"[INFO] Sent chunk {i // chunk_size + 1}/{-(-len(combined_data) // chunk_size)}: {len(chunk)} bytes")
                 except Exception as e:
                     print(f"[ERROR] Failed to send chunk {i // chunk_size + 1}: {e}")
-                    return
+                    return False
 
             # 終了信号の送信
             try:
                 await client.write_gatt_char(CHAR_UUID, b"END")
-                print("[INFO] End signal sent successfully.")
+                if verbose:
+                    print("[INFO] End signal sent successfully.")
             except Exception as e:
                 print(f"[ERROR] Failed to send end signal: {e}")
-                return
+                return False
 
-            print("[INFO] All data sent successfully.")
+            if verbose:
+                print("[INFO] All data sent successfully.")
+            return True
         else:
             print("[ERROR] Failed to connect to peripheral")
+            return False
 
 
 def main():
     BLACK_IMAGE_PATH = "images/black_image.png"  # 黒色の入力画像データ
     RED_IMAGE_PATH = "images/red_image.png"  # 赤色の入力画像データ
     OUTPUT_DIR = "output_images"  # 出力ディレクトリ
-    IMAGE_SIZE = (250, 122)  # 画像サイズ
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     # 黒画像の処理
@@ -109,7 +131,7 @@ def main():
     red_data = prepare_image(RED_IMAGE_PATH, IMAGE_SIZE)
     reconstruct_image(red_data,  (IMAGE_SIZE[1], IMAGE_SIZE[0]), os.path.join(OUTPUT_DIR, "reconstructed_red_image.png"))
 
-    asyncio.run(send_image(BLACK_IMAGE_PATH, RED_IMAGE_PATH, IMAGE_SIZE, mtu=244))
+    asyncio.run(send_image(BLACK_IMAGE_PATH, RED_IMAGE_PATH, IMAGE_SIZE, mtu=MTU))
 
 if __name__ == "__main__":
     main()
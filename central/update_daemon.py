@@ -0,0 +1,441 @@
+"""
+電子ペーパー更新デーモン。
+
+1つのプロセスを起動したままにして、ローカルのHTTP API (Unixソケット or localhost) で
+更新ジョブを受け付ける。ジョブは SQLite に保存されるので、再起動しても失われない。
+変換済みの画像データはキャッシュし、同じフレームを何台にも送るときは変換を1回で済ませる。
+
+起動:
+    python update_daemon.py --socket /tmp/ble_central.sock --db update_jobs.db
+
+API (JSONでやりとり):
+    POST /jobs          {"address": "2C:CF:67:04:CF:1B", "black": "images/black_image.png", "red": "images/red_image.png"}
+    POST /jobs/bulk     {"jobs": [{"address": ..., "black": ..., "red": ...}, ...]}
+    GET  /jobs/<id>     ジョブの状態と所要時間
+    GET  /jobs?status=queued&after=0&limit=100    id の昇順、after より後のジョブ
+    GET  /stats         状態ごとのジョブ数
+
+同じタグ宛てのジョブがまだ待っている間に新しいジョブを送ると、古い方は superseded になる。
+送信が終わったタグには、描画が終わるまで (--settle-seconds) 次のジョブを送らない。
+
+例:
+    curl --unix-socket /tmp/ble_central.sock -d @jobs.json http://localhost/jobs/bulk
+
+画像のパスはデーモンのカレントディレクトリからの相対パスとして解決される。
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import re
+import signal
+import sqlite3
+import stat
+import time
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import ble_central
+
+FRAME_CACHE_SIZE = 64
+MAX_BODY_SIZE = 64 * 1024 * 1024
+MAX_LIST_LIMIT = 10000
+ADDRESS_PATTERN = re.compile(r"[0-9A-F]{2}(:[0-9A-F]{2}){5}")  # 例: 2C:CF:67:04:CF:1B
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    address TEXT NOT NULL,
+    black TEXT NOT NULL,
+    red TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    not_before REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_address ON jobs (address, status);
+CREATE TABLE IF NOT EXISTS tags (
+    address TEXT PRIMARY KEY,
+    ready_at REAL NOT NULL
+);
+"""
+
+# ジョブが実行可能になる時刻: やり直し待ちとタグの描画待ちの遅い方
+READY_AT = "MAX(jobs.not_before, COALESCE(tags.ready_at, 0))"
+
+
+class BadRequest(Exception):
+    pass
+
+
+class LengthRequired(Exception):
+    pass
+
+
+class JobStore:
+    """
+    SQLite に保存するジョブキュー。
+    状態は queued -> running -> done / failed と遷移する。
+    同じタグ宛ての新しいジョブが来ると、待っているジョブは superseded になる。
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        # 前回の停止時に実行中だったジョブはやり直す
+        with self.db:
+            self.db.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+
+    def add(self, jobs):
+        now = time.time()
+        ids = []
+        with self.db:
+            for job in jobs:
+                # 表示されるのは最後のフレームだけなので、古いジョブは送らない
+                self.db.execute(
+                    "UPDATE jobs SET status = 'superseded', finished_at = ? WHERE address = ? AND status = 'queued'",
+                    (now, job["address"]),
+                )
+                ids.append(self.db.execute(
+                    "INSERT INTO jobs (address, black, red, created_at) VALUES (?, ?, ?, ?)",
+                    (job["address"], job["black"], job["red"], now),
+                ).lastrowid)
+        return ids
+
+    def claim(self, busy_addresses, now):
+        """
+        実行中でないタグ宛てで、now の時点で実行してよい一番古いジョブを running にして返す。
+        """
+        placeholders = ",".join("?" * len(busy_addresses))
+        row = self.db.execute(
+            f"SELECT jobs.* FROM jobs LEFT JOIN tags USING (address) "
+            f"WHERE jobs.status = 'queued' AND {READY_AT} <= ? "
+            f"AND jobs.address NOT IN ({placeholders}) ORDER BY jobs.id LIMIT 1",
+            (now, *busy_addresses),
+        ).fetchone()
+        if row is None:
+            return None
+        with self.db:
+            self.db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+                (now, row["id"]),
+            )
+        return self.get(row["id"])
+
+    def next_ready(self, busy_addresses):
+        """実行中でないタグ宛てのジョブが次に実行可能になる時刻。無ければ None。"""
+        placeholders = ",".join("?" * len(busy_addresses))
+        return self.db.execute(
+            f"SELECT MIN({READY_AT}) FROM jobs LEFT JOIN tags USING (address) "
+            f"WHERE jobs.status = 'queued' AND jobs.address NOT IN ({placeholders})",
+            tuple(busy_addresses),
+        ).fetchone()[0]
+
+    def settle(self, address, ready_at):
+        """タグが描画を終えるまで (ready_at まで) そのタグ宛てのジョブを出さない。"""
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO tags (address, ready_at) VALUES (?, ?)", (address, ready_at))
+
+    def finish(self, job_id, error=None, retry_at=None):
+        """
+        ジョブを done / failed にする。retry_at を指定すると、その時刻以降に
+        やり直すよう queued に戻す。ただし同じタグ宛ての新しいジョブが
+        既に待っていれば、古いフレームを送り直さないよう superseded にする。
+        """
+        with self.db:
+            if error is None:
+                self.db.execute(
+                    "UPDATE jobs SET status = 'done', error = NULL, finished_at = ? WHERE id = ?",
+                    (time.time(), job_id),
+                )
+            elif retry_at is not None and self.db.execute(
+                "SELECT 1 FROM jobs WHERE status = 'queued' AND id > ? "
+                "AND address = (SELECT address FROM jobs WHERE id = ?)",
+                (job_id, job_id),
+            ).fetchone():
+                self.db.execute(
+                    "UPDATE jobs SET status = 'superseded', error = ?, finished_at = ? WHERE id = ?",
+                    (error, time.time(), job_id),
+                )
+            elif retry_at is not None:
+                self.db.execute(
+                    "UPDATE jobs SET status = 'queued', error = ?, started_at = NULL, finished_at = NULL, "
+                    "not_before = ? WHERE id = ?",
+                    (error, retry_at, job_id),
+                )
+            else:
+                self.db.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                    (error, time.time(), job_id),
+                )
+
+    def get(self, job_id):
+        return self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def list(self, status=None, after=0, limit=100):
+        """id の昇順で返す。after を指定するとその id より後から返す。"""
+        if status is None:
+            return self.db.execute(
+                "SELECT * FROM jobs WHERE id > ? ORDER BY id LIMIT ?", (after, limit)
+            ).fetchall()
+        return self.db.execute(
+            "SELECT * FROM jobs WHERE status = ? AND id > ? ORDER BY id LIMIT ?", (status, after, limit)
+        ).fetchall()
+
+    def counts(self):
+        rows = self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        self.db.close()
+
+
+def job_to_dict(row):
+    job = dict(row)
+    job["wait_seconds"] = None if row["started_at"] is None else row["started_at"] - row["created_at"]
+    job["run_seconds"] = (
+        None if row["started_at"] is None or row["finished_at"] is None
+        else row["finished_at"] - row["started_at"]
+    )
+    return job
+
+
+def validate_job(job):
+    if not isinstance(job, dict):
+        raise BadRequest("Each job must be an object")
+    address = job.get("address")
+    if not isinstance(address, str) or not address:
+        raise BadRequest("Job is missing 'address'")
+    if not ADDRESS_PATTERN.fullmatch(address.upper()):
+        raise BadRequest(f"Invalid address {address!r}, expected XX:XX:XX:XX:XX:XX")
+    validated = {"address": address.upper()}
+    for key in ("black", "red"):
+        path = job.get(key)
+        if not isinstance(path, str) or not os.path.isfile(path):
+            raise BadRequest(f"Job for {address}: '{key}' image not found: {path}")
+        validated[key] = os.path.abspath(path)
+    return validated
+
+
+class UpdateDaemon:
+    def __init__(self, store, concurrency=1, max_attempts=3, retry_delay=5.0, settle_seconds=35.0,
+                 mtu=ble_central.MTU, verbose=False):
+        self.store = store
+        self.verbose = verbose
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay  # 1回目のやり直しまでの秒数。以降は倍々に延ばす
+        # 送信後、タグは切断されるとすぐにアドバタイズを再開するが、描画はまだ終わっていない
+        # (1秒のタイマー + Clear と display で2回のリフレッシュ + 1秒の待ち)。
+        # その間に次のフレームを送るとタグのバッファが壊れるので、この秒数だけ待つ。
+        self.settle_seconds = settle_seconds
+        self.mtu = mtu
+        self.busy_addresses = set()
+        self.frames = collections.OrderedDict()  # (黒, 赤, 更新時刻) -> 変換済みデータ
+        self.wakeup = None
+        self.stopping = None
+
+    # --- ワーカー ---
+
+    async def _load_frame(self, black, red):
+        key = (black, red, os.path.getmtime(black), os.path.getmtime(red))
+        frame = self.frames.get(key)
+        if frame is None:
+            # PILでの変換は重いので、イベントループを止めないよう別スレッドで行う
+            loop = asyncio.get_running_loop()
+            frame = await loop.run_in_executor(None, ble_central.prepare_frame, black, red, ble_central.IMAGE_SIZE)
+            self.frames[key] = frame
+            if len(self.frames) > FRAME_CACHE_SIZE:
+                self.frames.popitem(last=False)
+        else:
+            self.frames.move_to_end(key)
+        return frame
+
+    async def _run_job(self, job):
+        error = None
+        try:
+            frame = await self._load_frame(job["black"], job["red"])
+            if not await ble_central.send_frame(frame, self.mtu, job["address"], verbose=self.verbose):
+                error = "Transfer failed"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        retry_at = None
+        if error is not None and job["attempts"] < self.max_attempts:
+            retry_at = time.time() + self.retry_delay * 2 ** (job["attempts"] - 1)
+        if error is None:
+            self.store.settle(job["address"], time.time() + self.settle_seconds)
+        self.store.finish(job["id"], error, retry_at)
+        if error is None:
+            if self.verbose:
+                print(f"[INFO] Job {job['id']} done: {job['address']}")
+        else:
+            print(f"[ERROR] Job {job['id']} {job['address']} attempt {job['attempts']}: {error}")
+
+    async def _worker(self):
+        while True:
+            job = self.store.claim(self.busy_addresses, time.time())
+            if job is None:
+                # 新しいジョブが来るか、待たせているジョブの時刻になるまで眠る
+                self.wakeup.clear()
+                ready_at = self.store.next_ready(self.busy_addresses)
+                timeout = None if ready_at is None else max(ready_at - time.time(), 0)
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.busy_addresses.add(job["address"])
+            try:
+                await self._run_job(job)
+            finally:
+                self.busy_addresses.discard(job["address"])
+                self.wakeup.set()  # 同じタグ宛てで待っているジョブを起こす
+
+    # --- HTTP API ---
+
+    def submit(self, jobs):
+        ids = self.store.add([validate_job(job) for job in jobs])
+        self.wakeup.set()
+        return ids
+
+    def route(self, method, target, body):
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+        payload = json.loads(body) if body else None
+
+        if method == "POST" and parts == ["jobs"]:
+            return HTTPStatus.CREATED, {"id": self.submit([payload])[0]}
+        if method == "POST" and parts == ["jobs", "bulk"]:
+            if not isinstance(payload, dict) or not isinstance(payload.get("jobs"), list):
+                raise BadRequest("Body must be {\"jobs\": [...]}")
+            return HTTPStatus.CREATED, {"ids": self.submit(payload["jobs"])}
+        if method == "GET" and parts == ["jobs"]:
+            query = parse_qs(url.query)
+            status = query.get("status", [None])[0]
+            after = int(query.get("after", ["0"])[0])
+            limit = int(query.get("limit", ["100"])[0])
+            if not 1 <= limit <= MAX_LIST_LIMIT:
+                raise BadRequest(f"'limit' must be between 1 and {MAX_LIST_LIMIT}")
+            rows = self.store.list(status, after, limit)
+            return HTTPStatus.OK, {"jobs": [job_to_dict(row) for row in rows]}
+        if method == "GET" and len(parts) == 2 and parts[0] == "jobs":
+            row = self.store.get(int(parts[1]))
+            if row is None:
+                return HTTPStatus.NOT_FOUND, {"error": f"Job {parts[1]} not found"}
+            return HTTPStatus.OK, job_to_dict(row)
+        if method == "GET" and parts == ["stats"]:
+            return HTTPStatus.OK, {"jobs": self.store.counts(), "running": sorted(self.busy_addresses)}
+        return HTTPStatus.NOT_FOUND, {"error": f"No route for {method} {url.path}"}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if "transfer-encoding" in headers:
+                # チャンク形式は解釈しないので、空のボディとして扱わずにはっきり断る
+                raise LengthRequired("Transfer-Encoding is not supported, send the body with Content-Length")
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_SIZE:
+                raise BadRequest("Request body too large")
+            body = await reader.readexactly(length)
+            status, payload = self.route(method, target, body)
+        except (BadRequest, ValueError) as e:
+            status, payload = HTTPStatus.BAD_REQUEST, {"error": str(e) or "Bad request"}
+        except LengthRequired as e:
+            status, payload = HTTPStatus.LENGTH_REQUIRED, {"error": str(e)}
+        except asyncio.IncompleteReadError:
+            writer.close()
+            return
+        except Exception as e:
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"}
+
+        data = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def stop(self):
+        self.stopping.set()
+
+    async def serve(self, socket_path=None, port=None):
+        self.wakeup = asyncio.Event()
+        if socket_path is not None:
+            if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.unlink(socket_path)  # 前回の残りのソケットファイル
+            server = await asyncio.start_unix_server(self._handle_connection, path=socket_path)
+            print(f"[INFO] Listening on unix:{socket_path}")
+        else:
+            server = await asyncio.start_server(self._handle_connection, host="127.0.0.1", port=port)
+            print(f"[INFO] Listening on http://127.0.0.1:{port}")
+
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        print(f"[INFO] Pending jobs: {self.store.counts().get('queued', 0)}")
+        async with server:
+            await self.stopping.wait()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+        print("[INFO] Daemon stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-running e-paper update daemon with a local job API.")
+    parser.add_argument("--socket", default="/tmp/ble_central.sock", help="unix socket path for the API")
+    parser.add_argument("--port", type=int, help="serve on 127.0.0.1:PORT instead of a unix socket")
+    parser.add_argument("--db", default="update_jobs.db", help="SQLite job store")
+    parser.add_argument("--concurrency", type=int, default=1, help="simultaneous BLE connections")
+    parser.add_argument("--max-attempts", type=int, default=3, help="tries per job before it is marked failed")
+    parser.add_argument("--retry-delay", type=float, default=5.0, help="seconds before the first retry, doubled each time")
+    parser.add_argument("--settle-seconds", type=float, default=35.0,
+                        help="time a tag needs to render after a transfer before it can take the next one")
+    parser.add_argument("--verbose", action="store_true", help="log every job and BLE transfer step")
+    args = parser.parse_args()
+
+    store = JobStore(args.db)
+    daemon = UpdateDaemon(
+        store,
+        concurrency=args.concurrency,
+        max_attempts=args.max_attempts,
+        retry_delay=args.retry_delay,
+        settle_seconds=args.settle_seconds,
+        verbose=args.verbose,
+    )
+    try:
+        asyncio.run(daemon.serve(socket_path=None if args.port else args.socket, port=args.port))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
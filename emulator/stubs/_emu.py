@@ -0,0 +1,27 @@
+"""
+エミュレータ内部の共有状態。
+
+スタブモジュール (ubluetooth / machine / utime / bleak) は、
+生成時や呼び出し時にこのモジュールを通して対象の仮想タグを見つける。
+"""
+import threading
+
+_local = threading.local()
+
+fleet = {}  # MACアドレス(大文字) -> VirtualTag
+
+
+def bind(tag):
+    """現在のスレッドを仮想タグに紐付ける。"""
+    _local.tag = tag
+
+
+def bound_tag():
+    return getattr(_local, "tag", None)
+
+
+def current_tag():
+    tag = bound_tag()
+    if tag is None:
+        raise RuntimeError("No virtual tag is bound to this thread")
+    return tag
@@ -0,0 +1,66 @@
+"""
+bleak のスタンドイン。
+
+ble_central.py をそのまま動かすため、BleakClient を仮想タグへの接続に置き換える。
+ble_central.py は `await client.is_connected()` を使うので、is_connected はコルーチンにしている。
+"""
+import asyncio
+import time
+
+import _emu
+
+
+class BleakError(Exception):
+    pass
+
+
+class BleakClient:
+    def __init__(self, address_or_ble_device, timeout=10.0, **kwargs):
+        self.address = str(address_or_ble_device).upper()
+        self.timeout = timeout
+        self._tag = None
+
+    @property
+    def mtu_size(self):
+        if self._tag is None:
+            return 23
+        return self._tag.ble.config("mtu")
+
+    async def connect(self, **kwargs):
+        tag = _emu.fleet.get(self.address)
+        if tag is None:
+            raise BleakError("Device with address {} was not found.".format(self.address))
+
+        # 描画中などでアドバタイズしていない間は、タイムアウトまで接続を待つ
+        # (タイムアウトもエミュレート時間なので time_scale で縮める)
+        deadline = time.monotonic() + self.timeout * tag.time_scale
+        while not tag.central_connect():
+            if time.monotonic() > deadline:
+                raise BleakError("Connection to {} timed out.".format(self.address))
+            await asyncio.sleep(tag.conn_interval)
+        await asyncio.sleep(tag.conn_interval)
+        self._tag = tag
+        return True
+
+    async def disconnect(self):
+        if self._tag is not None:
+            self._tag.central_disconnect()
+            self._tag = None
+        return True
+
+    async def is_connected(self):
+        return self._tag is not None and self._tag.connected
+
+    async def write_gatt_char(self, char_specifier, data, response=True):
+        if not await self.is_connected():
+            raise BleakError("Not connected")
+        # 書き込み1回につきコネクションインターバル1回分かかるものとする
+        await asyncio.sleep(self._tag.conn_interval)
+        await asyncio.wrap_future(self._tag.central_write(str(char_specifier), bytes(data)))
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.disconnect()
@@ -0,0 +1,86 @@
+"""
+MicroPython framebuf のスタンドイン。
+
+EPDドライバが使う1ビット形式 (MONO_VLSB / MONO_HLSB / MONO_HMSB) だけを実装する。
+組み込みフォントが無いので text() は持たない。
+"""
+
+MONO_VLSB = 0
+MONO_HLSB = 3
+MONO_HMSB = 4
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format, stride=None):
+        if format not in (MONO_VLSB, MONO_HLSB, MONO_HMSB):
+            raise ValueError("Unsupported framebuf format: {}".format(format))
+        self.buffer = buffer
+        self.width = width
+        self.height = height
+        self.format = format
+        self.stride = stride if stride is not None else width
+        if format != MONO_VLSB:
+            self.stride = (self.stride + 7) & ~7
+
+    def _locate(self, x, y):
+        if self.format == MONO_VLSB:
+            return (y >> 3) * self.stride + x, 1 << (y & 7)
+        index = (y * self.stride + x) >> 3
+        if self.format == MONO_HLSB:
+            return index, 0x80 >> (x & 7)
+        return index, 1 << (x & 7)
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        index, mask = self._locate(x, y)
+        if c is None:
+            return 1 if self.buffer[index] & mask else 0
+        if c:
+            self.buffer[index] |= mask
+        else:
+            self.buffer[index] &= ~mask & 0xFF
+
+    def fill(self, c):
+        value = 0xFF if c else 0x00
+        for i in range(len(self.buffer)):
+            self.buffer[i] = value
+
+    def fill_rect(self, x, y, w, h, c):
+        for yy in range(max(y, 0), min(y + h, self.height)):
+            for xx in range(max(x, 0), min(x + w, self.width)):
+                self.pixel(xx, yy, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def line(self, x1, y1, x2, y2, c):
+        # ブレゼンハムのアルゴリズム
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        err = dx + dy
+        while True:
+            self.pixel(x1, y1, c)
+            if x1 == x2 and y1 == y2:
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x1 += sx
+            if e2 <= dx:
+                err += dx
+                y1 += sy
@@ -0,0 +1,73 @@
+"""
+MicroPython machine (Pin / SPI / Timer) のスタンドイン。
+
+生成時にスレッドに紐付いた仮想タグを捕まえ、
+ピンとSPIの操作はそのタグの VirtualPanel に、タイマーはタグのワーカーに渡す。
+"""
+from _emu import current_tag
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self._panel = current_tag().panel
+        if value is not None:
+            self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            return self._panel.read_pin(self.id)
+        self._panel.write_pin(self.id, 1 if value else 0)
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+
+class SPI:
+    def __init__(self, id, baudrate=1000_000, **kwargs):
+        self.id = id
+        self.baudrate = baudrate
+        self._panel = current_tag().panel
+
+    def init(self, baudrate=1000_000, **kwargs):
+        self.baudrate = baudrate
+
+    def deinit(self):
+        pass
+
+    def write(self, buf):
+        self._panel.spi_write(buf)
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self.id = id
+        self._tag = current_tag()
+        self._handle = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None):
+        self.deinit()
+        if freq > 0:
+            period = 1000 / freq
+        self._handle = self._tag.schedule_timer(self, mode == Timer.PERIODIC, period, callback)
+
+    def deinit(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
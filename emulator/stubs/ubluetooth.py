@@ -0,0 +1,156 @@
+"""
+MicroPython ubluetooth のスタンドイン。
+
+GATTサーバとアドバタイズの状態だけを持つ。セントラル側からの接続・書き込みは
+VirtualTag が _central_* メソッドで注入し、IRQ はタグのワーカースレッドで配送される。
+"""
+import threading
+
+from _emu import current_tag
+
+FLAG_BROADCAST = 0x0001
+FLAG_READ = 0x0002
+FLAG_WRITE_NO_RESPONSE = 0x0004
+FLAG_WRITE = 0x0008
+FLAG_NOTIFY = 0x0010
+FLAG_INDICATE = 0x0020
+
+_IRQ_CENTRAL_CONNECT = 1
+_IRQ_CENTRAL_DISCONNECT = 2
+_IRQ_GATTS_WRITE = 3
+_IRQ_MTU_EXCHANGED = 21
+
+_DEFAULT_MTU = 23
+_DEFAULT_BUFFER_SIZE = 20
+
+
+class UUID:
+    def __init__(self, value):
+        if isinstance(value, UUID):
+            value = value._value
+        self._value = value.lower() if isinstance(value, str) else value
+
+    def __eq__(self, other):
+        return isinstance(other, UUID) and self._value == other._value
+
+    def __hash__(self):
+        return hash(self._value)
+
+    def __str__(self):
+        return self._value if isinstance(self._value, str) else "0x{:04x}".format(self._value)
+
+    def __repr__(self):
+        return "UUID({!r})".format(self._value)
+
+
+class _Attribute:
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.value = bytearray()
+        self.size = _DEFAULT_BUFFER_SIZE
+        self.append = False
+
+
+class BLE:
+    def __init__(self):
+        self._tag = current_tag()
+        self._tag.ble = self
+        self._lock = threading.Lock()
+        self._active = False
+        self._config = {"mtu": _DEFAULT_MTU, "gap_name": "MPY"}
+        self._handler = None
+        self._attributes = {}  # ハンドル -> _Attribute
+        self._next_handle = 1
+        self.advertising = False
+        self.adv_data = b""
+
+    def active(self, flag=None):
+        if flag is not None:
+            self._active = bool(flag)
+        return self._active
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config[args[0]]
+        self._config.update(kwargs)
+
+    def irq(self, handler):
+        self._handler = handler
+
+    def gatts_register_services(self, services):
+        handles = []
+        with self._lock:
+            for service_uuid, characteristics in services:
+                self._next_handle += 1  # サービス宣言
+                service_handles = []
+                for characteristic in characteristics:
+                    self._next_handle += 1  # キャラクタリスティック宣言
+                    value_handle = self._next_handle
+                    self._next_handle += 1
+                    self._attributes[value_handle] = _Attribute(UUID(characteristic[0]))
+                    service_handles.append(value_handle)
+                handles.append(tuple(service_handles))
+        return tuple(handles)
+
+    def gatts_set_buffer(self, value_handle, len, append=False):
+        with self._lock:
+            attribute = self._attributes[value_handle]
+            attribute.size = len
+            attribute.append = append
+            del attribute.value[len:]
+
+    def gatts_read(self, value_handle):
+        with self._lock:
+            attribute = self._attributes[value_handle]
+            value = bytes(attribute.value)
+            if attribute.append:
+                attribute.value = bytearray()
+        return value
+
+    def gatts_write(self, value_handle, data, send_update=False):
+        with self._lock:
+            attribute = self._attributes[value_handle]
+            attribute.value = bytearray(data[:attribute.size])
+
+    def gap_advertise(self, interval_us, adv_data=None, resp_data=None, connectable=True):
+        with self._lock:
+            self.advertising = interval_us is not None
+            if adv_data is not None:
+                self.adv_data = bytes(adv_data)
+
+    def gap_disconnect(self, conn_handle):
+        self._tag.central_disconnect()
+        return True
+
+    # --- 以下はエミュレータ (VirtualTag) から呼ばれる ---
+
+    def _dispatch(self, event, data):
+        if self._handler is not None:
+            self._handler(event, data)
+
+    def _central_connect(self):
+        """アドバタイズ中なら接続を受け付け、アドバタイズを止める。"""
+        with self._lock:
+            if not (self._active and self.advertising):
+                return False
+            self.advertising = False
+            return True
+
+    def _central_write(self, uuid, data):
+        """
+        スタックの属性バッファに書き込み、IRQ用の値ハンドルを返す。
+        バッファを超えた分は実機と同じく切り捨てられる。
+        """
+        uuid = UUID(uuid)
+        with self._lock:
+            for value_handle, attribute in self._attributes.items():
+                if attribute.uuid == uuid:
+                    break
+            else:
+                raise KeyError("Characteristic {} not found".format(uuid))
+            if attribute.append:
+                attribute.value.extend(data)
+                del attribute.value[attribute.size:]
+            else:
+                attribute.value = bytearray(data[:attribute.size])
+        return value_handle
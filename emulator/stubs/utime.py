@@ -0,0 +1,41 @@
+"""
+MicroPython utime のスタンドイン。
+
+待ち時間は仮想タグの time_scale で縮めて実時間で眠る。
+ペリフェラルの `time` もこのモジュールに差し替えられる。
+"""
+import time as _time
+
+from _emu import current_tag
+
+
+def sleep(seconds):
+    _time.sleep(seconds * current_tag().time_scale)
+
+
+def sleep_ms(ms):
+    sleep(ms / 1000.0)
+
+
+def sleep_us(us):
+    sleep(us / 1000_000.0)
+
+
+def ticks_ms():
+    return int(_time.monotonic() / current_tag().time_scale * 1000)
+
+
+def ticks_us():
+    return int(_time.monotonic() / current_tag().time_scale * 1000_000)
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def ticks_diff(ticks1, ticks2):
+    return ticks1 - ticks2
+
+
+def time():
+    return int(_time.time())
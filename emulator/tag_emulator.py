@@ -0,0 +1,552 @@
+"""
+仮想電子ペーパータグのエミュレータ。
+
+peripheral/main.py の BLEPeripheral と epaper2in13.py のドライバを、
+stubs/ 以下のスタンドイン (ubluetooth / machine / framebuf / utime) の上で
+CPython のまま動かす。1プロセスで数百台のタグを起動し、
+central/ble_central.py をそのまま使って一斉に画像を送り、
+スループットと表示内容の正しさを測る。
+
+使い方:
+    python tag_emulator.py --tags 200 --concurrency 16 --out-dir emulator_output
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import importlib.util
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+import traceback
+
+EMULATOR_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(EMULATOR_DIR)
+sys.path.insert(0, os.path.join(EMULATOR_DIR, "stubs"))
+
+import _emu  # noqa: E402
+import utime  # noqa: E402
+
+CENTRAL_MTU = 247
+LOG_LINES = 200
+
+
+def _load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _tag_print(*args, sep=" ", end="\n", **kwargs):
+    """ペリフェラル側の print をタグごとのログに振り分ける。"""
+    tag = _emu.bound_tag()
+    if tag is None:
+        print(*args, sep=sep, end=end)
+        return
+    tag.write_log(sep.join(str(arg) for arg in args))
+
+
+epaper2in13 = _load_module("epaper2in13", os.path.join(PROJECT_DIR, "peripheral", "epaper2in13.py"))
+firmware = _load_module("peripheral_main", os.path.join(PROJECT_DIR, "peripheral", "main.py"))
+firmware.time = utime  # MicroPython の time は utime と同じもの
+epaper2in13.print = _tag_print
+firmware.print = _tag_print
+
+
+def load_central():
+    """central/ble_central.py を bleak スタブ付きで読み込む。読み込み済みならそれを返す。"""
+    central = sys.modules.get("ble_central")
+    if central is None:
+        central = _load_module("ble_central", os.path.join(PROJECT_DIR, "central", "ble_central.py"))
+    return central
+
+
+def _step(value, increment, window):
+    low, high = min(window), max(window)
+    if increment:
+        return (low, True) if value >= high else (value + 1, False)
+    return (high, True) if value <= low else (value - 1, False)
+
+
+class VirtualPanel:
+    """
+    2.13インチ B V4 パネル (SSD1680系コントローラ) のモデル。
+
+    ピンとSPIで送られたコマンドを解釈してRAMに書き込み、
+    0x20 (表示更新) でRAMを表示内容として確定し、refresh_ms の間 BUSY を立てる。
+    """
+
+    RAM_COLUMNS = (epaper2in13.EPD_WIDTH + 7) // 8  # 1バイト = 横8ピクセル
+    RAM_ROWS = epaper2in13.EPD_HEIGHT
+
+    # コマンドごとのパラメータ長
+    PARAM_LENGTHS = {0x01: 3, 0x10: 1, 0x11: 1, 0x18: 1, 0x21: 2, 0x22: 1,
+                     0x3C: 1, 0x44: 2, 0x45: 4, 0x4E: 1, 0x4F: 2}
+
+    def __init__(self, tag, refresh_ms, reset_ms):
+        self.tag = tag
+        self.refresh_ms = refresh_ms
+        self.reset_ms = reset_ms
+        self.pins = {}
+        size = self.RAM_COLUMNS * self.RAM_ROWS
+        self.ram_black = bytearray(b"\xff" * size)
+        self.ram_red = bytearray(size)
+        self.shown_black = bytes(self.ram_black)
+        self.shown_red = bytes(self.ram_red)
+        self.shown_control = 0x00
+        self.refresh_count = 0
+        self.busy_until = 0.0
+        self._reset_registers()
+
+    def _reset_registers(self):
+        self.entry_mode = 0x03
+        self.x_window = (0, self.RAM_COLUMNS - 1)
+        self.y_window = (0, self.RAM_ROWS - 1)
+        self.x = 0
+        self.y = 0
+        self.control = 0x00
+        self.sleeping = False
+        self._command = None
+        self._params = bytearray()
+
+    def _busy_for(self, ms):
+        self.busy_until = max(self.busy_until, time.monotonic()) + ms / 1000.0 * self.tag.time_scale
+
+    def read_pin(self, pin_id):
+        if pin_id == epaper2in13.BUSY_PIN:
+            return 1 if time.monotonic() < self.busy_until else 0
+        return self.pins.get(pin_id, 0)
+
+    def write_pin(self, pin_id, value):
+        previous = self.pins.get(pin_id)
+        self.pins[pin_id] = value
+        if pin_id == epaper2in13.RST_PIN and previous == 1 and value == 0:
+            # ハードウェアリセット: レジスタは初期化されるがRAMは保持される
+            self._reset_registers()
+            self._busy_for(self.reset_ms)
+
+    def spi_write(self, buf):
+        if self.pins.get(epaper2in13.CS_PIN, 1) != 0 or self.sleeping:
+            return
+        if self.pins.get(epaper2in13.DC_PIN, 0) == 0:
+            for command in buf:
+                self._begin_command(command)
+        else:
+            buf = bytes(buf)
+            if self._command in (0x24, 0x26):
+                buf = self._write_rows(buf)
+            for value in buf:
+                self._data(value)
+
+    def _write_rows(self, buf):
+        """
+        X方向が先に進むモードで窓が全幅のとき、行単位でまとめてRAMにコピーする。
+        コピーできなかった残りを返す。
+        """
+        if self.entry_mode != 0x03 or self.x_window != (0, self.RAM_COLUMNS - 1) or self.x != 0:
+            return buf
+        rows = min(len(buf) // self.RAM_COLUMNS, max(self.y_window) - self.y + 1)
+        if rows <= 0:
+            return buf
+        ram = self.ram_black if self._command == 0x24 else self.ram_red
+        start = self.y * self.RAM_COLUMNS
+        size = rows * self.RAM_COLUMNS
+        ram[start:start + size] = buf[:size]
+        self.y += rows
+        if self.y > max(self.y_window):
+            self.y = min(self.y_window)
+        return buf[size:]
+
+    def _begin_command(self, command):
+        self._command = command
+        self._params = bytearray()
+        if command == 0x12:  # SWRESET
+            self._reset_registers()
+            self._busy_for(self.reset_ms)
+        elif command == 0x20:  # 表示更新
+            self.shown_black = bytes(self.ram_black)
+            self.shown_red = bytes(self.ram_red)
+            self.shown_control = self.control
+            self.refresh_count += 1
+            self._busy_for(self.refresh_ms)
+
+    def _data(self, value):
+        if self._command in (0x24, 0x26):
+            ram = self.ram_black if self._command == 0x24 else self.ram_red
+            if self.x < self.RAM_COLUMNS and self.y < self.RAM_ROWS:
+                ram[self.y * self.RAM_COLUMNS + self.x] = value
+            self._advance()
+            return
+
+        length = self.PARAM_LENGTHS.get(self._command)
+        if length is None or len(self._params) >= length:
+            return
+        self._params.append(value)
+        if len(self._params) == length:
+            self._apply(self._command, self._params)
+
+    def _apply(self, command, params):
+        if command == 0x11:  # データエントリモード
+            self.entry_mode = params[0] & 0x07
+        elif command == 0x44:
+            self.x_window = (params[0] & 0x3F, params[1] & 0x3F)
+        elif command == 0x45:
+            self.y_window = (params[0] | (params[1] & 0x01) << 8, params[2] | (params[3] & 0x01) << 8)
+        elif command == 0x4E:
+            self.x = params[0] & 0x3F
+        elif command == 0x4F:
+            self.y = params[0] | (params[1] & 0x01) << 8
+        elif command == 0x21:  # 表示更新制御 (RAMの反転指定)
+            self.control = params[0]
+        elif command == 0x10:  # ディープスリープ
+            self.sleeping = params[0] != 0
+
+    def _advance(self):
+        x_increment = self.entry_mode & 0x01
+        y_increment = self.entry_mode & 0x02
+        if self.entry_mode & 0x04:  # Y方向に先に進める
+            self.y, wrapped = _step(self.y, y_increment, self.y_window)
+            if wrapped:
+                self.x, _ = _step(self.x, x_increment, self.x_window)
+        else:
+            self.x, wrapped = _step(self.x, x_increment, self.x_window)
+            if wrapped:
+                self.y, _ = _step(self.y, y_increment, self.y_window)
+
+    def to_image(self):
+        """現在表示されている内容を縦向きのRGB画像として返す。"""
+        from PIL import Image
+
+        bw_inverse = 1 if self.shown_control & 0x08 else 0
+        red_inverse = 1 if self.shown_control & 0x80 else 0
+        pixels = []
+        for y in range(self.RAM_ROWS):
+            for x in range(epaper2in13.EPD_WIDTH):
+                index = y * self.RAM_COLUMNS + x // 8
+                shift = 7 - x % 8
+                if (self.shown_red[index] >> shift & 1) ^ red_inverse:
+                    pixels.append((255, 0, 0))
+                elif (self.shown_black[index] >> shift & 1) ^ bw_inverse:
+                    pixels.append((255, 255, 255))
+                else:
+                    pixels.append((0, 0, 0))
+        img = Image.new("RGB", (epaper2in13.EPD_WIDTH, self.RAM_ROWS))
+        img.putdata(pixels)
+        return img
+
+
+class _TimerHandle:
+    def __init__(self, tag, timer, periodic, period_ms, callback):
+        self.tag = tag
+        self.timer = timer
+        self.periodic = periodic
+        self.period = max(period_ms, 0) / 1000.0 * tag.time_scale
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._active = True
+        self.tag._begin()
+        self._arm()
+
+    def _arm(self):
+        self._thread = threading.Timer(self.period, self._fire)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fire(self):
+        with self._lock:
+            if not self._active:
+                return
+            if not self.periodic:
+                self._active = False
+        if self.callback is not None:
+            self.tag.post(lambda: self.callback(self.timer))
+        if self.periodic:
+            self._arm()
+        else:
+            self.tag._end()
+
+    def cancel(self):
+        with self._lock:
+            if not self._active:
+                return
+            self._active = False
+        self._thread.cancel()
+        self.tag._end()
+
+
+class VirtualTag:
+    """
+    1台分の仮想タグ。
+
+    ファームウェアのコード (起動処理、IRQ、タイマーコールバック) は
+    すべてタグ専用のワーカースレッドで1つずつ実行される。
+    """
+
+    def __init__(self, address, name="ShelfTag", time_scale=1.0, refresh_ms=15000, reset_ms=10,
+                 conn_interval_ms=7.5, echo=False):
+        self.address = address.upper()
+        self.name = name
+        self.time_scale = time_scale
+        self.conn_interval = conn_interval_ms / 1000.0 * time_scale
+        self.echo = echo
+        self.panel = VirtualPanel(self, refresh_ms, reset_ms)
+        self.ble = None  # ファームウェアが ubluetooth.BLE() を作ると設定される
+        self.peripheral = None
+        self.connected = False
+        self.errors = 0
+        self.log = collections.deque(maxlen=LOG_LINES)
+        self._link_lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=self.address, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self.post(self._boot)
+
+    def stop(self):
+        self._jobs.put(None)
+
+    def _boot(self):
+        self.peripheral = firmware.BLEPeripheral(name=self.name)
+
+    def _run(self):
+        _emu.bind(self)
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            try:
+                job()
+            except Exception:
+                self.errors += 1
+                self.write_log("[EMU] " + traceback.format_exc())
+            finally:
+                self._end()
+
+    def post(self, job):
+        self._begin()
+        self._jobs.put(job)
+
+    def _begin(self):
+        with self._idle:
+            self._pending += 1
+
+    def _end(self):
+        with self._idle:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """キュー済みの処理と未発火のタイマーがなくなるまで待つ。"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def schedule_timer(self, timer, periodic, period_ms, callback):
+        return _TimerHandle(self, timer, periodic, period_ms, callback)
+
+    def write_log(self, line):
+        self.log.append(line)
+        if line.lower().startswith(("[error]", "error")):
+            self.errors += 1
+        if self.echo:
+            sys.stdout.write(f"[{self.address}] {line}\n")
+
+    # --- 以下は bleak スタブ (セントラル側) から呼ばれる ---
+
+    def _irq(self, event, data):
+        done = concurrent.futures.Future()
+
+        def job():
+            try:
+                self.ble._dispatch(event, data)
+            finally:
+                done.set_result(None)
+
+        self.post(job)
+        return done
+
+    def central_connect(self):
+        with self._link_lock:
+            if self.ble is None or self.connected or not self.ble._central_connect():
+                return False
+            self.connected = True
+        self._irq(1, (0, 0, bytes(6)))  # _IRQ_CENTRAL_CONNECT
+        self._irq(21, (0, min(CENTRAL_MTU, self.ble.config("mtu"))))  # _IRQ_MTU_EXCHANGED
+        return True
+
+    def central_write(self, uuid, data):
+        """
+        書き込みをIRQで配送し、ハンドラが読み終えたら完了する Future を返す。
+        エミュレータではスレッドの遅れで後続の書き込みが追い越さないよう、
+        応答をハンドラの処理後に返す。
+        """
+        value_handle = self.ble._central_write(uuid, data)
+        return self._irq(3, (0, value_handle))  # _IRQ_GATTS_WRITE
+
+    def central_disconnect(self):
+        with self._link_lock:
+            if not self.connected:
+                return
+            self.connected = False
+        self._irq(2, (0, 0, bytes(6)))  # _IRQ_CENTRAL_DISCONNECT
+
+
+class TagFleet:
+    """同じプロセスで動く仮想タグの集まり。"""
+
+    def __init__(self, count, time_scale=0.05, refresh_ms=15000, reset_ms=10, conn_interval_ms=7.5, echo=False):
+        self.time_scale = time_scale
+        self.tags = [
+            VirtualTag(
+                "02:00:00:00:{:02X}:{:02X}".format(i >> 8 & 0xFF, i & 0xFF),
+                time_scale=time_scale,
+                refresh_ms=refresh_ms,
+                reset_ms=reset_ms,
+                conn_interval_ms=conn_interval_ms,
+                echo=echo,
+            )
+            for i in range(count)
+        ]
+
+    def start(self, timeout=None):
+        """全タグを起動し、初期化 (パネルのクリア) が終わるまで待つ。"""
+        for tag in self.tags:
+            _emu.fleet[tag.address] = tag
+            tag.start()
+        return self.wait_idle(timeout)
+
+    def stop(self):
+        for tag in self.tags:
+            tag.stop()
+            _emu.fleet.pop(tag.address, None)
+
+    def wait_idle(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for tag in self.tags:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not tag.wait_idle(remaining):
+                return False
+        return True
+
+    def dump_png(self, out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+        for tag in self.tags:
+            tag.panel.to_image().save(os.path.join(out_dir, tag.address.replace(":", "") + ".png"))
+
+
+async def _send_all(central, tags, frame, concurrency, verbose):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(tag):
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                ok = await central.send_frame(frame, central.MTU, tag.address, verbose=verbose)
+            except Exception as e:
+                print(f"[ERROR] {tag.address}: {e}")
+                return None
+            if not ok:
+                print(f"[ERROR] {tag.address}: upload failed")
+                return None
+            return time.monotonic() - started
+
+    return await asyncio.gather(*(send(tag) for tag in tags))
+
+
+def run_load_test(fleet, black_path, red_path, concurrency, verbose=False):
+    """
+    ble_central.send_frame で全タグに同じフレームを送り、所要時間と表示内容の正しさを集計する。
+
+    フレームの変換は最初に1回だけ行うので、計測にはタグ数に比例するPILの処理は含まれない。
+    時間はすべて実時間で、--time-scale 1.0 のときだけ実機と比べられる。
+    """
+    central = load_central()
+    frame = bytes(central.prepare_frame(black_path, red_path, central.IMAGE_SIZE))
+    expected_black = frame[:len(frame) // 2]
+    expected_red = frame[len(frame) // 2:]
+    refreshes_before = {tag.address: tag.panel.refresh_count for tag in fleet.tags}
+
+    started = time.monotonic()
+    durations = asyncio.run(_send_all(central, fleet.tags, frame, concurrency, verbose))
+    sent = time.monotonic()
+    fleet.wait_idle()
+    finished = time.monotonic()
+
+    failed = [
+        tag for tag in fleet.tags
+        if tag.panel.shown_black != expected_black
+        or tag.panel.shown_red != expected_red
+        or tag.panel.refresh_count == refreshes_before[tag.address]
+    ]
+    uploads = [d for d in durations if d is not None]
+    upload_failed = [tag for tag, d in zip(fleet.tags, durations) if d is None]
+    count = len(fleet.tags)
+
+    print(f"[INFO] Tags: {count}, concurrency: {concurrency}, time scale: {fleet.time_scale}")
+    if fleet.time_scale != 1.0:
+        print("[INFO] Times below are wall-clock at this time scale; use --time-scale 1.0 to compare with hardware")
+    print(f"[INFO] Upload phase: {sent - started:.2f} s ({len(uploads) / (sent - started):.1f} tags/s)")
+    print(f"[INFO] Failed uploads: {len(upload_failed)}/{count}")
+    if uploads:
+        print(f"[INFO] Upload per tag: mean {statistics.mean(uploads):.3f} s, "
+              f"median {statistics.median(uploads):.3f} s, max {max(uploads):.3f} s")
+    print(f"[INFO] All panels settled: {finished - started:.2f} s")
+    print(f"[INFO] Correct panels: {count - len(failed)}/{count}")
+    for tag in failed[:10]:
+        last = tag.log[-1] if tag.log else ""
+        print(f"[ERROR] {tag.address}: wrong panel contents (errors={tag.errors}, last log: {last})")
+
+    return {
+        "tags": count,
+        "upload_seconds": sent - started,
+        "total_seconds": finished - started,
+        "upload_durations": uploads,
+        "upload_failed": [tag.address for tag in upload_failed],
+        "failed": [tag.address for tag in failed],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test ble_central.py against a fleet of virtual e-paper tags.")
+    parser.add_argument("--tags", type=int, default=100, help="number of virtual tags")
+    parser.add_argument("--concurrency", type=int, default=8, help="simultaneous central connections")
+    parser.add_argument("--time-scale", type=float, default=0.05, help="real seconds per emulated second")
+    parser.add_argument("--refresh-ms", type=float, default=15000, help="panel refresh (BUSY) time")
+    parser.add_argument("--conn-interval-ms", type=float, default=7.5, help="BLE connection interval")
+    parser.add_argument("--black", default=os.path.join(PROJECT_DIR, "central", "images", "black_image.png"))
+    parser.add_argument("--red", default=os.path.join(PROJECT_DIR, "central", "images", "red_image.png"))
+    parser.add_argument("--out-dir", default="emulator_output", help="where to write each tag's panel as PNG")
+    parser.add_argument("--verbose", action="store_true", help="echo peripheral and central logs")
+    args = parser.parse_args()
+
+    fleet = TagFleet(
+        args.tags,
+        time_scale=args.time_scale,
+        refresh_ms=args.refresh_ms,
+        conn_interval_ms=args.conn_interval_ms,
+        echo=args.verbose,
+    )
+    print(f"[INFO] Booting {args.tags} virtual tags...")
+    booted = time.monotonic()
+    fleet.start()
+    print(f"[INFO] Tags ready in {time.monotonic() - booted:.2f} s")
+
+    result = run_load_test(fleet, args.black, args.red, args.concurrency, verbose=args.verbose)
+
+    if args.out_dir:
+        fleet.dump_png(args.out_dir)
+        print(f"[INFO] Panel images saved to {args.out_dir}")
+    fleet.stop()
+    sys.exit(1 if result["failed"] or result["upload_failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -172,7 +172,7 @@ class EPD_2in13_B_V4_Portrait:
         
     def display(self):
         self.send_command(0x24)
-        self.send_data1(self.buffer_balck)
+        self.send_data1(self.buffer_black)
         
         self.send_command(0x26)
         self.send_data1(self.buffer_red)  
@@ -0,0 +1,116 @@
+"""
+仮想タグ (emulator/tag_emulator.py) のテスト。
+"""
+import hashlib
+import os
+import sys
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, "emulator"))
+
+import tag_emulator  # noqa: E402
+import _emu  # noqa: E402
+
+TIME_SCALE = 0.01
+RAM_COLUMNS = tag_emulator.VirtualPanel.RAM_COLUMNS
+
+
+def fake_frame(black, red, size):
+    """PIL を使わず、画像パスごとに異なる 8000 バイトのフレームを作る。"""
+    digest = hashlib.sha256(f"{black}|{red}".encode()).digest()
+    return bytearray((digest * 250)[:8000])
+
+
+@pytest.fixture
+def fleet():
+    fleet = tag_emulator.TagFleet(3, time_scale=TIME_SCALE)
+    assert fleet.start(timeout=30)
+    yield fleet
+    fleet.stop()
+
+
+def send(panel, command, data=b""):
+    """CS を下げてコマンドとデータを送る。"""
+    panel.pins[tag_emulator.epaper2in13.CS_PIN] = 0
+    panel.pins[tag_emulator.epaper2in13.DC_PIN] = 0
+    panel.spi_write(bytes([command]))
+    panel.pins[tag_emulator.epaper2in13.DC_PIN] = 1
+    panel.spi_write(bytes(data))
+
+
+def test_run_load_test_updates_every_panel(fleet, monkeypatch):
+    monkeypatch.setattr(tag_emulator.load_central(), "prepare_frame", fake_frame)
+    result = tag_emulator.run_load_test(fleet, "black.png", "red.png", concurrency=2)
+
+    assert result["failed"] == []
+    assert result["upload_failed"] == []
+    assert len(result["upload_durations"]) == len(fleet.tags)
+    frame = fake_frame("black.png", "red.png", None)
+    for tag in fleet.tags:
+        assert tag.panel.shown_black == frame[:4000]
+        assert tag.panel.shown_red == frame[4000:]
+
+
+def test_dump_png_writes_one_image_per_tag(fleet, tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    fleet.dump_png(str(tmp_path))
+    for tag in fleet.tags:
+        with Image.open(tmp_path / (tag.address.replace(":", "") + ".png")) as img:
+            assert img.size == (tag_emulator.epaper2in13.EPD_WIDTH, tag_emulator.epaper2in13.EPD_HEIGHT)
+
+
+def test_landscape_driver_uses_y_first_entry_mode():
+    tag = tag_emulator.VirtualTag("02:00:00:00:FF:00", time_scale=TIME_SCALE)
+    _emu.bind(tag)
+    try:
+        epd = tag_emulator.epaper2in13.EPD_2in13_B_V4_Landscape()
+        for i in range(len(epd.buffer_black)):
+            epd.buffer_black[i] = i & 0xFF
+            epd.buffer_red[i] = (i * 7) & 0xFF
+        epd.display()
+    finally:
+        _emu.bind(None)
+
+    # 横向きでは列 j を逆順に、Y方向を先に進めて書き込む (データエントリモード 0x07)
+    assert tag.panel.entry_mode == 0x07
+    for j in range(RAM_COLUMNS):
+        for i in range(epd.height):
+            index = i * RAM_COLUMNS + (RAM_COLUMNS - 1 - j)
+            assert tag.panel.shown_black[index] == epd.buffer_black[i + j * epd.height]
+            assert tag.panel.shown_red[index] == epd.buffer_red[i + j * epd.height]
+
+
+def test_partial_window_write():
+    tag = tag_emulator.VirtualTag("02:00:00:00:FF:01", time_scale=TIME_SCALE)
+    panel = tag.panel
+    send(panel, 0x11, [0x03])
+    send(panel, 0x44, [2, 3])  # X: 2..3 バイト目
+    send(panel, 0x45, [10, 0, 11, 0])  # Y: 10..11 行目
+    send(panel, 0x4E, [2])
+    send(panel, 0x4F, [10, 0])
+    send(panel, 0x24, [0xA1, 0xA2, 0xB1, 0xB2, 0xC1])
+
+    ram = panel.ram_black
+    # 窓の右端で次の行へ、最後の行の後は窓の先頭へ戻る
+    assert ram[10 * RAM_COLUMNS + 2:10 * RAM_COLUMNS + 4] == bytes([0xC1, 0xA2])
+    assert ram[11 * RAM_COLUMNS + 2:11 * RAM_COLUMNS + 4] == bytes([0xB1, 0xB2])
+    assert ram.count(0xFF) == len(ram) - 4
+
+
+def test_full_width_window_wraps_rows():
+    tag = tag_emulator.VirtualTag("02:00:00:00:FF:02", time_scale=TIME_SCALE)
+    panel = tag.panel
+    send(panel, 0x44, [0, RAM_COLUMNS - 1])
+    send(panel, 0x45, [10, 0, 11, 0])
+    send(panel, 0x4E, [0])
+    send(panel, 0x4F, [10, 0])
+    rows = [bytes([value]) * RAM_COLUMNS for value in (0x11, 0x22, 0x33)]
+    send(panel, 0x26, b"".join(rows) + b"\x44")
+
+    # 3行目は窓の先頭の行に戻って上書きし、残りの1バイトはその次の行に入る
+    ram = panel.ram_red
+    assert ram[10 * RAM_COLUMNS:11 * RAM_COLUMNS] == rows[2]
+    assert ram[11 * RAM_COLUMNS:12 * RAM_COLUMNS] == b"\x44" + rows[1][1:]
+    assert (panel.x, panel.y) == (1, 11)
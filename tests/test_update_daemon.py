@@ -0,0 +1,204 @@
+"""
+update_daemon を仮想タグ (emulator/tag_emulator.py) に対して動かすテスト。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, "emulator"))
+sys.path.insert(0, os.path.join(PROJECT_DIR, "central"))
+
+import tag_emulator  # noqa: E402  bleak スタブもここで sys.path に入る
+
+ble_central = tag_emulator.load_central()
+
+import update_daemon  # noqa: E402
+
+TIME_SCALE = 0.01
+# 描画 (1 s タイマー + 15 s のリフレッシュ2回 + 1 s 待ち) を TIME_SCALE で縮めた時間より長く
+SETTLE_SECONDS = 1.0
+
+
+def fake_frame(black, red, size):
+    """PIL を使わず、画像パスごとに異なる 8000 バイトのフレームを作る。"""
+    digest = hashlib.sha256(f"{black}|{red}".encode()).digest()
+    return bytearray((digest * 250)[:8000])
+
+
+@pytest.fixture
+def fleet():
+    # 転送中にジョブを追加できるよう、書き込み1回を約3 msにする
+    fleet = tag_emulator.TagFleet(4, time_scale=TIME_SCALE, conn_interval_ms=300)
+    assert fleet.start(timeout=30)
+    yield fleet
+    fleet.stop()
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    monkeypatch.setattr(ble_central, "prepare_frame", fake_frame)
+    paths = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.png"
+        path.write_bytes(b"")
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = update_daemon.JobStore(str(tmp_path / "jobs.db"))
+    yield store
+    store.close()
+
+
+async def request(socket_path, method, path, body=None):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    data = json.dumps(body).encode() if body is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+
+async def wait_for_jobs(socket_path, ids, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        jobs = [(await request(socket_path, "GET", f"/jobs/{job_id}"))[1] for job_id in ids]
+        if all(job["status"] not in ("queued", "running") for job in jobs):
+            return jobs
+        await asyncio.sleep(0.05)
+    raise TimeoutError("Jobs did not finish")
+
+
+def test_bulk_jobs_reach_every_panel(fleet, images, store, tmp_path):
+    a, b, c = images
+    first, second = fleet.tags[0], fleet.tags[1]
+    refreshes_before = {tag.address: tag.panel.refresh_count for tag in fleet.tags}
+    socket_path = str(tmp_path / "daemon.sock")
+    daemon = update_daemon.UpdateDaemon(store, concurrency=4, settle_seconds=SETTLE_SECONDS)
+
+    async def scenario():
+        serving = asyncio.create_task(daemon.serve(socket_path=socket_path))
+        while not os.path.exists(socket_path):
+            await asyncio.sleep(0.01)
+
+        # 同じタグ宛てが3件あっても、送られるのは最後のフレームだけ
+        jobs = [{"address": tag.address.lower(), "black": a, "red": a} for tag in fleet.tags]
+        jobs.append({"address": first.address, "black": b, "red": b})
+        jobs.append({"address": first.address, "black": c, "red": c})
+        status, body = await request(socket_path, "POST", "/jobs/bulk", {"jobs": jobs})
+        assert status == 201
+        results = await wait_for_jobs(socket_path, body["ids"])
+
+        # 転送中に次のジョブを積んでも、タグの描画が終わるまで送られない
+        ids = [(await request(socket_path, "POST", "/jobs", {"address": second.address, "black": b, "red": b}))[1]["id"]]
+        deadline = time.monotonic() + 30
+        while second.address not in daemon.busy_addresses:
+            if time.monotonic() > deadline:
+                raise TimeoutError("Job never started")
+            await asyncio.sleep(0.001)
+        ids.append((await request(socket_path, "POST", "/jobs", {"address": second.address, "black": b, "red": c}))[1]["id"])
+        results += await wait_for_jobs(socket_path, ids)
+
+        daemon.stop()
+        await serving
+        return results
+
+    results = asyncio.run(scenario())
+    assert fleet.wait_idle(timeout=30)
+
+    assert [job["status"] for job in results] == ["superseded", "done", "done", "done", "superseded", "done", "done", "done"]
+    assert all(job["attempts"] <= 1 for job in results)
+
+    expected = {tag.address: fake_frame(a, a, None) for tag in fleet.tags}
+    expected[first.address] = fake_frame(c, c, None)
+    expected[second.address] = fake_frame(b, c, None)
+    for tag in fleet.tags:
+        frame = expected[tag.address]
+        assert tag.panel.shown_black == frame[:4000], tag.address
+        assert tag.panel.shown_red == frame[4000:], tag.address
+        assert tag.errors == 0, list(tag.log)
+    # 1回の更新で Clear と display の2回リフレッシュする
+    assert first.panel.refresh_count == refreshes_before[first.address] + 2
+    assert second.panel.refresh_count == refreshes_before[second.address] + 6
+
+
+def test_chunked_body_is_rejected(store, tmp_path):
+    socket_path = str(tmp_path / "daemon.sock")
+    daemon = update_daemon.UpdateDaemon(store)
+
+    async def scenario():
+        serving = asyncio.create_task(daemon.serve(socket_path=socket_path))
+        while not os.path.exists(socket_path):
+            await asyncio.sleep(0.01)
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        body = b'{"jobs": []}'
+        writer.write(
+            b"POST /jobs/bulk HTTP/1.1\r\nHost: localhost\r\nTransfer-Encoding: chunked\r\n\r\n"
+            + f"{len(body):x}\r\n".encode() + body + b"\r\n0\r\n\r\n"
+        )
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        daemon.stop()
+        await serving
+        return response
+
+    response = asyncio.run(scenario())
+    assert response.startswith(b"HTTP/1.1 411 ")
+    assert b"Transfer-Encoding" in response
+
+
+def test_failed_job_waits_for_backoff(store):
+    job_id, = store.add([{"address": "2C:CF:67:04:CF:1B", "black": "b.png", "red": "r.png"}])
+    job = store.claim(set(), now=100.0)
+    assert job["id"] == job_id
+
+    store.finish(job_id, "Transfer failed", retry_at=110.0)
+    assert store.get(job_id)["status"] == "queued"
+    assert store.get(job_id)["started_at"] is None
+    assert store.claim(set(), now=105.0) is None
+    assert store.next_ready(set()) == 110.0
+    assert store.claim(set(), now=110.0)["attempts"] == 2
+
+
+def test_failed_job_is_not_retried_over_newer_job(store):
+    old_id, = store.add([{"address": "2C:CF:67:04:CF:1B", "black": "old.png", "red": "old.png"}])
+    assert store.claim(set(), now=100.0)["id"] == old_id
+    new_id, = store.add([{"address": "2C:CF:67:04:CF:1B", "black": "new.png", "red": "new.png"}])
+
+    store.finish(old_id, "Transfer failed", retry_at=110.0)
+    assert store.get(old_id)["status"] == "superseded"
+    assert store.claim(set(), now=120.0)["id"] == new_id
+    store.finish(new_id)
+    assert store.claim(set(), now=200.0) is None
+
+
+def test_settling_tag_is_not_claimed(store):
+    store.add([{"address": "2C:CF:67:04:CF:1B", "black": "b.png", "red": "r.png"}])
+    store.settle("2C:CF:67:04:CF:1B", 50.0)
+    assert store.claim(set(), now=40.0) is None
+    assert store.next_ready(set()) == 50.0
+    assert store.claim(set(), now=50.0) is not None
+
+
+@pytest.mark.parametrize("target", ["/jobs?limit=0", "/jobs?limit=-1", f"/jobs?limit={update_daemon.MAX_LIST_LIMIT + 1}"])
+def test_list_limit_out_of_range(store, target):
+    daemon = update_daemon.UpdateDaemon(store)
+    with pytest.raises(update_daemon.BadRequest):
+        daemon.route("GET", target, b"")
+
+
+@pytest.mark.parametrize("address", ["AA", "", "2C:CF:67:04:CF", "2C-CF-67-04-CF-1B", "GG:CF:67:04:CF:1B"])
+def test_invalid_address_rejected(images, address):
+    with pytest.raises(update_daemon.BadRequest):
+        update_daemon.validate_job({"address": address, "black": images[0], "red": images[0]})